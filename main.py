@@ -1,14 +1,20 @@
 import ijson
 import streamlit as st
 import pandas as pd
+import numpy as np
+import xlsxwriter
+import openpyxl
 import zipfile
 import psutil
 import os
-import io
-import json
-import re
+import tempfile
+import orjson
 import gc
-# import ijson     # Uncomment if you want to use ijson for streaming JSON parsing
+import collections
+import itertools
+import sys
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 # --- App Title and Instructions ---
 st.title("AlphaFold3 Results Compiler")
@@ -26,39 +32,317 @@ When finished, click **Generate Excel** to consolidate all results.
 """)
 
 # --- Helper Function ---
-def extract_bait_prey(file_identifier):
+_SUFFIX = "summary_confidences_4.json"
+_RECORD_COLUMNS = (
+    "Bait", "Prey", "iptm", "pair iptm", "fraction disordered", "hash clash", "ranking score",
+    "chain iptm", "chain ptm", "chain pair iptm", "chain pair pae min",
+)
+# Scalar columns, kept as float64 arrays rather than lists of Python floats.
+_FLOAT_COLUMNS = ("iptm", "pair iptm", "fraction disordered", "hash clash", "ranking score")
+_CHAIN_KEYS = ("chain_iptm", "chain_ptm", "chain_pair_iptm", "chain_pair_pae_min")
+_JSON_KEYS = frozenset(("iptm", "ptm", "fraction_disordered", "has_clash", "ranking_score") + _CHAIN_KEYS)
+_STREAM_THRESHOLD = 256 * 1024  # Members larger than this (uncompressed) are streamed with ijson.
+_PARALLEL_MIN_BYTES = 4 * 1024 * 1024  # ZIPs with less JSON than this are decoded on one thread.
+_MEMBER_WORKERS = 4
+_LOG_TAIL = 500         # Most recent debug messages kept and shown in the text area.
+_LOG_FLUSH_EVERY = 100  # Debug messages logged between automatic redraws.
+# iptm highlight bands in the Excel export: (criteria, value or (minimum, maximum), background color).
+_CF_RULES = (
+    ('>', 0.79, '#FFFF99'),
+    ('between', (0.6, 0.79), '#ADD8E6'),
+    ('between', (0.40001, 0.59999), '#D3D3D3'),
+)
+
+def extract_bait_prey(filename):
     """
-    Extracts bait and prey names from a file identifier.
+    Extracts bait and prey names from a JSON file's base name.
     Expected pattern: ..._bait_<Bait>_prey_<Prey>_summary_confidences_4.json
-    This regex excludes '/' and '\' but allows underscores.
+    Names may contain underscores; the last '_prey_' before the suffix splits them.
+    Names are interned, since the same bait recurs across every file of a screen.
     """
-    if "::" in file_identifier:
-        filename = os.path.basename(file_identifier.split("::")[-1])
-    else:
-        filename = os.path.basename(file_identifier)
-    pattern = r'bait_([^/\\]+)_prey_([^/\\]+)(?=_summary_confidences_4)'
-    match = re.search(pattern, filename)
-    if match:
-        return match.group(1), match.group(2)
-    else:
+    b = filename.find("bait_")
+    e = filename.rfind("_summary_confidences_4")
+    if b == -1 or e == -1:
         return None, None
+    p = filename.rfind("_prey_", b + 5, e)
+    if p <= b + 5 or p + 6 >= e:
+        return None, None
+    return sys.intern(filename[b + 5:p]), sys.intern(filename[p + 6:e])
+
+def load_member(z, info):
+    """
+    Reads the exported fields of one summary_confidences_4.json member of an open ZipFile.
+    Chain arrays are returned as compact JSON text, which is far smaller to keep in
+    session state than nested lists of floats. Safe to call from several threads:
+    zipfile serializes access to the shared handle.
+    """
+    if info.file_size > _STREAM_THRESHOLD:
+        # Stream large files, keeping only the top-level keys that are exported.
+        with z.open(info) as f:
+            data = {k: v for k, v in ijson.kvitems(f, "", use_float=True) if k in _JSON_KEYS}
+    else:
+        # Small files are decoded from the raw bytes in one call.
+        data = orjson.loads(z.read(info))
+    for key in _CHAIN_KEYS:
+        if data.get(key) is not None:
+            data[key] = orjson.dumps(data[key]).decode()
+    return data
+
+def load_members(z, targets, workers):
+    """
+    Yields (base, data) for each (info, base) target in order, where data is the
+    result of load_member or the exception it raised.
+    With more than one worker, members are decoded on a thread pool at most 2 * workers ahead of the consumer.
+    Each result is released when the consumer asks for the next one, before that one is decoded.
+    """
+    if workers == 1:
+        for info, base in targets:
+            try:
+                data = load_member(z, info)
+            except Exception as e:
+                data = e
+            yield base, data
+            del data
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Only a bounded window of members is submitted; each one consumed frees a slot for the next.
+        # Unbounded, the workers would race ahead and finished futures would pile up parsed JSON.
+        pending = iter(targets)
+        futures = collections.deque(
+            (base, executor.submit(load_member, z, info)) for info, base in itertools.islice(pending, 2 * workers)
+        )
+        while futures:
+            base, future = futures.popleft()
+            for info, next_base in itertools.islice(pending, 1):
+                futures.append((next_base, executor.submit(load_member, z, info)))
+            try:
+                data = future.result()
+            except Exception as e:
+                data = e
+            del future
+            yield base, data
+            del data
+
+def process_zip(uploaded_file):
+    """
+    Reads every summary_confidences_4.json in one uploaded ZIP.
+    Runs on a worker thread, so it does not call Streamlit; debug messages are
+    returned as (level, message) pairs alongside the extracted columns.
+    Float columns are NumPy arrays; the others are lists.
+    """
+    columns = {col: [] for col in _RECORD_COLUMNS}
+    columns.update({col: np.empty(0) for col in _FLOAT_COLUMNS})
+    messages = []
+    # Use the uploaded file object directly without reading it entirely into a new BytesIO.
+    with zipfile.ZipFile(uploaded_file) as z:
+        targets = []
+        for info in z.infolist():
+            # Process only the nested JSON file we need.
+            if info.filename.endswith(_SUFFIX):
+                # Archives built on Windows can use backslashes, which zipfile only normalizes on Windows.
+                targets.append((info, info.filename.rpartition("/")[2].rpartition("\\")[2]))
+        if not targets:
+            return columns, messages
+        # One slot per target; members that fail leave their slot to be overwritten or trimmed below.
+        iptm, pair_iptm, fraction_disordered, has_clash, ranking_score = (
+            np.full(len(targets), np.nan) for _ in _FLOAT_COLUMNS
+        )
+        n = 0
+
+        # Larger ZIPs are decoded on several threads, since zlib releases the GIL while inflating.
+        # Small ones stay serial, where thread hand-off would cost more than it saves.
+        workers = min(_MEMBER_WORKERS, len(targets), os.cpu_count() or 1)
+        if sum(info.file_size for info, _ in targets) < _PARALLEL_MIN_BYTES:
+            workers = 1
+        for base, data in load_members(z, targets, workers):
+            file_identifier = f"{uploaded_file.name}::{base}"
+            messages.append(("info", f"  Reading: {file_identifier}"))
+            try:
+                if isinstance(data, Exception):
+                    raise data
+                # Missing or null values stay NaN. Slot n is only kept once all five scores convert,
+                # so a member with a malformed score is skipped like one that fails to decode.
+                iptm[n] = data.get("iptm", np.nan)
+                pair_iptm[n] = data.get("ptm", np.nan)
+                fraction_disordered[n] = data.get("fraction_disordered", np.nan)
+                has_clash[n] = data.get("has_clash", np.nan)
+                ranking_score[n] = data.get("ranking_score", np.nan)
+            except Exception as e:
+                messages.append(("error", f"Error decoding JSON in {file_identifier}: {e}"))
+                continue
+            n += 1
+
+            bait, prey = extract_bait_prey(base)
+            if bait is None or prey is None:
+                messages.append(("warning", f"DEBUG: Could not extract bait/prey from {file_identifier}"))
+                bait, prey = "Unknown", "Unknown"
+
+            columns["Bait"].append(bait)
+            columns["Prey"].append(prey)
+            columns["chain iptm"].append(data.get("chain_iptm"))
+            columns["chain ptm"].append(data.get("chain_ptm"))
+            columns["chain pair iptm"].append(data.get("chain_pair_iptm"))
+            columns["chain pair pae min"].append(data.get("chain_pair_pae_min"))
+            # Only the extracted values are kept, so the parsed member is freed here rather than on the next pass.
+            del data
+    for col, values in zip(_FLOAT_COLUMNS, (iptm, pair_iptm, fraction_disordered, has_clash, ranking_score)):
+        columns[col] = values if n == len(values) else values[:n].copy()
+    return columns, messages
+
+def extend_columns(store, columns):
+    """
+    Appends one ZIP's extracted columns to the session's column store.
+    Float columns are over-allocated arrays whose first len(store["Bait"]) entries
+    are rows; their capacity doubles whenever an append would overflow it.
+    """
+    count = len(store["Bait"])
+    added = len(columns["Bait"])
+    for col in _RECORD_COLUMNS:
+        if col not in _FLOAT_COLUMNS:
+            store[col].extend(columns[col])
+            continue
+        values = store[col]
+        if count + added > len(values):
+            grown = np.empty(max(2 * len(values), count + added))
+            grown[:count] = values[:count]
+            values = store[col] = grown
+        values[count:count + added] = columns[col]
+
+def read_existing_excel(excel_file):
+    """
+    Reads the first sheet of a previously exported workbook into a DataFrame.
+    Rows are streamed from openpyxl's read-only mode straight into from_records,
+    skipping read_excel's per-cell conversion.
+    """
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        df = pd.DataFrame.from_records(rows, columns=header, coerce_float=True)
+        # Blank columns come back as None objects; read_excel gives them a float dtype, so match it.
+        return df.astype(dict.fromkeys(df.columns[df.isna().all()], "float64"))
+    finally:
+        workbook.close()
+
+def apply_iptm_formats(worksheet, first_row, last_row, col, formats):
+    """
+    Adds the _CF_RULES highlight bands to rows first_row..last_row (zero-based, inclusive) of column col.
+    `formats` holds the workbook formats created for each rule, in the same order.
+    """
+    for (criteria, value, _), cell_format in zip(_CF_RULES, formats):
+        rule = {'type': 'cell', 'criteria': criteria, 'format': cell_format}
+        if criteria == 'between':
+            rule['minimum'], rule['maximum'] = value
+        else:
+            rule['value'] = value
+        worksheet.conditional_format(first_row, col, last_row, col, rule)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def build_export(zip_digests, excel_digests, _columns, _excel_frames):
+    """
+    Combines the ZIP columns with previously exported frames and returns the xlsx bytes.
+    The digests identify the inputs, so repeated clicks on unchanged data reuse the
+    cached workbook; the underscored data arguments are left out of Streamlit's hash.
+    """
+    # Float columns are over-allocated, so only their first len(Bait) entries are rows.
+    # A single concat copies each frame's blocks once.
+    row_count = len(_columns["Bait"])
+    frames = [pd.DataFrame({col: values[:row_count] for col, values in _columns.items()})] if row_count else []
+    frames.extend(_excel_frames)
+    combined_df = pd.concat(frames, ignore_index=True, copy=False) if frames else pd.DataFrame()
+
+    # Sort once by bait, then iptm descending, so each bait's rows are a contiguous run.
+    # Rows without a bait are dropped, matching what groupby("Bait") did.
+    # Bait and Prey become categoricals, so sorting and splitting compare integer codes.
+    combined_df = combined_df[combined_df["Bait"].notna()].astype({"Bait": "category", "Prey": "category"})
+    bait_names = combined_df["Bait"].cat.categories
+    bait_codes = combined_df["Bait"].cat.codes.to_numpy()
+    iptm = combined_df["iptm"].to_numpy(dtype=np.float64, na_value=np.nan)
+    # lexsort orders by its last key first; negating iptm sorts it descending with NaN last.
+    order = np.lexsort((-iptm, bait_codes))
+    combined_df = combined_df.take(order)
+    bait_codes = bait_codes[order]
+    # Each bait's rows are a contiguous [start, stop) run of the sorted frame.
+    bounds = [0, *(np.flatnonzero(bait_codes[1:] != bait_codes[:-1]) + 1).tolist(), len(bait_codes)]
+    groups = zip(bounds[:-1], bounds[1:]) if len(bait_codes) else []
+    # The workbook is built in a disk-backed temporary file, so only the final bytes are held in memory.
+    with tempfile.TemporaryFile(suffix=".xlsx") as output:
+        # Rows are written with xlsxwriter directly, skipping pandas' per-cell to_excel formatter.
+        # constant_memory flushes each row to disk once the next one starts, so rows must only be appended.
+        with xlsxwriter.Workbook(output, {'constant_memory': True}) as workbook:
+            format_header = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+            iptm_formats = [workbook.add_format({'bg_color': color}) for _, _, color in _CF_RULES]
+
+            header = combined_df.columns.tolist()
+            iptm_col = header.index("iptm")
+            sheet_name = None
+            for start, stop in groups:
+                group_df = combined_df.iloc[start:stop]
+                # Baits sharing their first 31 characters sort next to each other and share one sheet.
+                name = str(bait_names[bait_codes[start]])[:31]
+                if name != sheet_name:
+                    sheet_name = name
+                    worksheet = workbook.add_worksheet(sheet_name)
+                    worksheet.write_row(0, 0, header, format_header)
+                    next_row = 1
+                first_row = next_row
+                rows = group_df.to_numpy(dtype=object)
+                # Missing values are written as blank cells, as to_excel does.
+                rows[pd.isna(rows)] = None
+                for row in rows:
+                    worksheet.write_row(next_row, 0, row)
+                    next_row += 1
+                apply_iptm_formats(worksheet, first_row, next_row - 1, iptm_col, iptm_formats)
+        output.seek(0)
+        return output.read()
 
 # --- Session State Initialization ---
-if "processed_records" not in st.session_state:
-    st.session_state.processed_records = []  # List of dictionaries from processed JSON files.
+if "processed_columns" not in st.session_state:
+    # One list per column from processed JSON files, or a growable float64 array for float columns.
+    st.session_state.processed_columns = {
+        col: np.empty(1024) if col in _FLOAT_COLUMNS else [] for col in _RECORD_COLUMNS
+    }
 if "processed_file_names" not in st.session_state:
-    st.session_state.processed_file_names = []  # Names of ZIP files already processed.
+    # Names of ZIP files already processed, in upload order, mapped to content digests of their bytes.
+    # A dict keeps the display order while making the duplicate-name check O(1).
+    st.session_state.processed_file_names = {}
+if "zip_cache" not in st.session_state:
+    st.session_state.zip_cache = {}  # Extracted columns keyed by a digest of each ZIP's bytes.
+if "excel_cache" not in st.session_state:
+    st.session_state.excel_cache = {}  # DataFrames read from uploaded Excel files, keyed by a digest of their bytes.
 if "debug_messages" not in st.session_state:
-    st.session_state.debug_messages = []
+    st.session_state.debug_messages = collections.deque(maxlen=_LOG_TAIL)
 
 # Debug log container
 debug_container = st.empty()
+debug_unflushed = 0
+debug_drawn = set()  # Hashes of the log texts already drawn in this run.
+def flush_debug_log():
+    # Streamlit rejects two identical text areas in one run, so redraw only when something was logged since the last draw.
+    # Once the log is at _LOG_TAIL, new messages can still rebuild a text drawn earlier, so that is checked too.
+    global debug_unflushed
+    if debug_drawn and not debug_unflushed:
+        return
+    debug_unflushed = 0
+    text = "\n".join(st.session_state.debug_messages)
+    if hash(text) in debug_drawn:
+        return
+    debug_drawn.add(hash(text))
+    debug_container.text_area("Debug Log", text, height=150)
+
 def update_debug_log(message):
+    # Redrawing on every message rebuilds the whole text each time, so redraws are batched.
+    global debug_unflushed
     st.session_state.debug_messages.append(message)
-    debug_container.text_area("Debug Log", "\n".join(st.session_state.debug_messages), height=150)
+    debug_unflushed += 1
+    if debug_unflushed >= _LOG_FLUSH_EVERY:
+        flush_debug_log()
 
 # --- Display System Memory ---
 process = psutil.Process(os.getpid())
+_DEBUG_MEM = bool(os.environ.get("AF3_DEBUG_MEM"))  # Set to log memory after every ZIP.
 st.write(f"Memory at newest upload: {process.memory_info().rss / 1024**2:.2f} MB")
 if st.button("Check Memory Usage"):
     mem_usage_mb = process.memory_info().rss / 1024**2  # Convert bytes to MB
@@ -72,63 +356,53 @@ uploaded_excel_files = st.file_uploader("Upload existing Excel files to combine
 
 # --- Process Uploaded ZIP Files Immediately Using Streaming ---
 if uploaded_zip_files:
-    update_debug_log(f"Memory before processing ZIPs: {process.memory_info().rss / 1024**2:.2f} MB")
+    pending = {}
     for file in uploaded_zip_files:
-        if file.name not in st.session_state.processed_file_names:
-            update_debug_log(f"Processing file: {file.name}")
-            try:
-                # Use the uploaded file object directly without reading it entirely into a new BytesIO.
-                with zipfile.ZipFile(file) as z:
-                    for item in z.namelist():
-                        # Process only the nested JSON file we need.
-                        if item.endswith("summary_confidences_4.json"):
-                            file_identifier = f"{file.name}::{os.path.basename(item)}"
-                            update_debug_log(f"  Reading: {file_identifier}")
-                            try:
-                                with z.open(item) as f:
-                                    # If the JSON files are very large, use a streaming parser like ijson.
-                                    parser = ijson.parse(f)
-                                    data = {}  # Build your JSON object piece by piece.
-                                    # For now, we assume the JSON file is reasonably small:
-                                    data = json.load(f)
-                            except Exception as e:
-                                st.error(f"Error decoding JSON in {file_identifier}: {e}")
-                                update_debug_log(f"Error decoding JSON in {file_identifier}: {e}")
-                                continue
-
-                            bait, prey = extract_bait_prey(file_identifier)
-                            if bait is None or prey is None:
-                                st.warning(f"DEBUG: Could not extract bait/prey from {file_identifier}")
-                                update_debug_log(f"DEBUG: Could not extract bait/prey from {file_identifier}")
-                                bait, prey = "Unknown", "Unknown"
-
-                            record = {
-                                "Bait": bait,
-                                "Prey": prey,
-                                "iptm": data.get("iptm"),
-                                "pair iptm": data.get("ptm"),
-                                "fraction disordered": data.get("fraction_disordered"),
-                                "hash clash": data.get("has_clash"),
-                                "ranking score": data.get("ranking_score"),
-                                "chain iptm": json.dumps(data.get("chain_iptm")),
-                                "chain ptm": json.dumps(data.get("chain_ptm")),
-                                "chain pair iptm": json.dumps(data.get("chain_pair_iptm")),
-                                "chain pair pae min": json.dumps(data.get("chain_pair_pae_min"))
-                            }
-                            st.session_state.processed_records.append(record)
-                st.session_state.processed_file_names.append(file.name)
-                update_debug_log(f"Finished processing: {file.name}")
-            except Exception as e:
-                st.error(f"Error processing file {file.name}: {e}")
-                update_debug_log(f"Error processing file {file.name}: {e}")
-            finally:
+        if file.name not in st.session_state.processed_file_names and file.name not in pending:
+            pending[file.name] = (file, hashlib.blake2b(file.getbuffer(), digest_size=16).hexdigest())
+    if pending:
+        update_debug_log(f"Memory before processing ZIPs: {process.memory_info().rss / 1024**2:.2f} MB")
+        # Decompression and JSON decoding overlap across ZIPs; Streamlit calls stay on this thread.
+        # ZIPs whose bytes were already extracted reuse the cached columns instead of being parsed again.
+        with ThreadPoolExecutor(max_workers=min(8, len(pending))) as executor:
+            futures = [
+                (file, digest, None if digest in st.session_state.zip_cache else executor.submit(process_zip, file))
+                for file, digest in pending.values()
+            ]
+            for file, digest, future in futures:
+                update_debug_log(f"Processing file: {file.name}")
                 try:
-                    file.close()
-                except Exception:
-                    update_debug_log(f"File {file.name}: {e} failed to close.")
-                del file
-                gc.collect()
-                update_debug_log(f"Memory after cleanup: {process.memory_info().rss / 1024**2:.2f} MB")
+                    if future is None:
+                        columns = st.session_state.zip_cache[digest]
+                        update_debug_log("  Reusing results from an identical ZIP already processed")
+                    else:
+                        columns, messages = future.result()
+                        for level, message in messages:
+                            if level == "error":
+                                st.error(message)
+                            elif level == "warning":
+                                st.warning(message)
+                            update_debug_log(message)
+                        st.session_state.zip_cache[digest] = columns
+                    extend_columns(st.session_state.processed_columns, columns)
+                    st.session_state.processed_file_names[file.name] = digest
+                    update_debug_log(f"Finished processing: {file.name}")
+                except Exception as e:
+                    st.error(f"Error processing file {file.name}: {e}")
+                    update_debug_log(f"Error processing file {file.name}: {e}")
+                finally:
+                    try:
+                        file.close()
+                    except Exception as e:
+                        update_debug_log(f"File {file.name}: {e} failed to close.")
+                    del file
+                    if _DEBUG_MEM:
+                        update_debug_log(f"Memory after cleanup: {process.memory_info().rss / 1024**2:.2f} MB")
+                    flush_debug_log()
+        # Reference counting frees each ZIP as it finishes; one collection per batch picks up any cycles.
+        gc.collect()
+        update_debug_log(f"Memory after processing ZIPs: {process.memory_info().rss / 1024**2:.2f} MB")
+    flush_debug_log()
 
 # --- Display Processed ZIP File Names ---
 if st.session_state.processed_file_names:
@@ -137,58 +411,26 @@ if st.session_state.processed_file_names:
         st.write(name)
 
 # --- Generate Excel Button ---
-if st.session_state.processed_records or uploaded_excel_files:
+if st.session_state.processed_columns["Bait"] or uploaded_excel_files:
     if st.button("Generate Excel"):
-        # Build DataFrame from processed ZIP data.
-        df_zip = pd.DataFrame(st.session_state.processed_records) if st.session_state.processed_records else pd.DataFrame()
-        df_existing_list = []
+        excel_frames, excel_digests = [], []
         if uploaded_excel_files:
             for excel_file in uploaded_excel_files:
                 try:
-                    df_existing = pd.read_excel(excel_file)
-                    df_existing_list.append(df_existing)
+                    # Parsed workbooks are kept across reruns, so repeated clicks don't re-read them.
+                    digest = hashlib.blake2b(excel_file.getbuffer(), digest_size=16).hexdigest()
+                    if digest not in st.session_state.excel_cache:
+                        st.session_state.excel_cache[digest] = read_existing_excel(excel_file)
+                    excel_frames.append(st.session_state.excel_cache[digest])
+                    excel_digests.append(digest)
                 except Exception as e:
                     st.error(f"Error reading Excel file {excel_file.name}: {e}")
-        if df_existing_list:
-            df_existing_all = pd.concat(df_existing_list, ignore_index=True)
-            combined_df = pd.concat([df_zip, df_existing_all], ignore_index=True)
-        else:
-            combined_df = df_zip
-
-        combined_df = combined_df.sort_values(by="iptm", ascending=False)
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            workbook = writer.book
-            format_light_yellow = workbook.add_format({'bg_color': '#FFFF99'})
-            format_light_blue   = workbook.add_format({'bg_color': '#ADD8E6'})
-            format_light_gray   = workbook.add_format({'bg_color': '#D3D3D3'})
-
-            for bait, group_df in combined_df.groupby("Bait"):
-                sheet_name = str(bait)[:31]
-                group_df.to_excel(writer, sheet_name=sheet_name, index=False)
-                worksheet = writer.sheets[sheet_name]
-                num_rows = len(group_df) + 1
-                iptm_range = f"C2:C{num_rows}"
-                worksheet.conditional_format(iptm_range, {
-                    'type': 'cell',
-                    'criteria': '>',
-                    'value': 0.79,
-                    'format': format_light_yellow
-                })
-                worksheet.conditional_format(iptm_range, {
-                    'type': 'cell',
-                    'criteria': 'between',
-                    'minimum': 0.6,
-                    'maximum': 0.79,
-                    'format': format_light_blue
-                })
-                worksheet.conditional_format(iptm_range, {
-                    'type': 'formula',
-                    'criteria': '=AND(C2>0.4, C2<0.6)',
-                    'format': format_light_gray
-                })
-        output.seek(0)
-        processed_data = output.getvalue()
+        processed_data = build_export(
+            tuple(st.session_state.processed_file_names.values()),
+            tuple(excel_digests),
+            st.session_state.processed_columns,
+            excel_frames,
+        )
         st.download_button(
             label="Download Consolidated Excel File",
             data=processed_data,